@@ -1,19 +1,25 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, AsyncIterator, AsyncContextManager, TypedDict, Callable, Awaitable
 import os
 import asyncio
+import hashlib
 import shutil
-import json
-from contextlib import AsyncExitStack
+import random
+import time
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager
 from uuid import uuid4
-import tempfile
 from fastapi.encoders import jsonable_encoder
 
 import openai
+import orjson
+import redis.asyncio as aioredis
+from redis.exceptions import LockError
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 # Load environment variables
 load_dotenv()
@@ -21,6 +27,140 @@ OPENAI_API_KEY = os.getenv("LLM_API_KEY")
 if not OPENAI_API_KEY:
     raise ValueError("LLM_API_KEY environment variable not set")
 
+# Shared async OpenAI client so the HTTP connection pool is reused across chat
+# turns and completions don't block the event loop. SDK retries are off so
+# the adaptive limiter below sees every rate limit and owns all retrying.
+aclient = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+# npm cache shared by all npx-launched MCP servers
+NPX_SHARED_CACHE = os.getenv("MCP_NPX_CACHE", os.path.expanduser("~/.cache/mcp_npx"))
+
+# Seconds an MCP server's tool list is reused before being refetched
+TOOLS_CACHE_TTL = float(os.getenv("TOOLS_CACHE_TTL", "60"))
+
+# Model for the main completion, and a smaller one for summarizing tool results
+PRIMARY_MODEL = os.getenv("PRIMARY_MODEL", "gpt-4.1")
+FOLLOWUP_MODEL = os.getenv("FOLLOWUP_MODEL", "gpt-4o-mini")
+
+# Cap on generated tokens per completion. The primary completion gets its own,
+# larger cap since it may carry long tool-call arguments (e.g. file contents)
+MAX_COMPLETION_TOKENS = int(os.getenv("MAX_COMPLETION_TOKENS", "1024"))
+PRIMARY_MAX_TOKENS = int(os.getenv("PRIMARY_MAX_TOKENS", "8192"))
+
+# Session history is trimmed to the system message plus at most the most recent
+# HISTORY_KEEP_MESSAGES, fewer if needed to fit MAX_HISTORY_CHARS, once it
+# exceeds either limit; the latest turn is always kept. With SUMMARIZE_HISTORY
+# the dropped turns are replaced by a short summary from FOLLOWUP_MODEL
+MAX_HISTORY_MESSAGES = int(os.getenv("MAX_HISTORY_MESSAGES", "20"))
+MAX_HISTORY_CHARS = int(os.getenv("MAX_HISTORY_CHARS", "24000"))
+HISTORY_KEEP_MESSAGES = max(1, int(os.getenv("HISTORY_KEEP_MESSAGES", "10")))
+# Tool results kept in history are cut to this many characters
+MAX_TOOL_RESULT_CHARS = int(os.getenv("MAX_TOOL_RESULT_CHARS", "8000"))
+SUMMARIZE_HISTORY = os.getenv("SUMMARIZE_HISTORY", "false").lower() in ("1", "true", "yes")
+
+# Bounds for the adaptive concurrency limit on OpenAI calls
+OPENAI_INITIAL_CONCURRENCY = int(os.getenv("OPENAI_INITIAL_CONCURRENCY", "4"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "64"))
+OPENAI_MAX_RETRIES = max(1, int(os.getenv("OPENAI_MAX_RETRIES", "5")))
+
+# Chat sessions live in Redis when REDIS_URL is set, otherwise in process memory
+REDIS_URL = os.getenv("REDIS_URL")
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))
+SESSION_LOCK_TIMEOUT = int(os.getenv("SESSION_LOCK_TIMEOUT", "300"))
+
+class AdaptiveLimiter:
+    """Concurrency limiter that adapts to the provider's capacity.
+
+    The limit grows by one after a full window of successful calls and is
+    halved whenever a call fails with ``overload_exception``.
+    """
+
+    def __init__(self, initial: int, maximum: int, overload_exception=Exception):
+        self.limit = max(1, initial)
+        self.maximum = max(self.limit, maximum)
+        self.overload_exception = overload_exception
+        self._active = 0
+        self._successes = 0
+        self._waiters: List[asyncio.Future] = []
+
+    @asynccontextmanager
+    async def slot(self):
+        while self._active >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self._active += 1
+        outcome = None
+        try:
+            yield
+            outcome = True
+        except self.overload_exception:
+            outcome = False
+            raise
+        finally:
+            # Bookkeeping is synchronous so a cancellation arriving here (e.g.
+            # a client disconnect mid-stream) can't leak the slot
+            self._active -= 1
+            if outcome is True:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            elif outcome is False:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            self._wake()
+
+    def _wake(self):
+        # Waiters re-check the limit themselves once woken
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        self._waiters.clear()
+
+openai_limiter = AdaptiveLimiter(
+    OPENAI_INITIAL_CONCURRENCY, OPENAI_MAX_CONCURRENCY, overload_exception=openai.RateLimitError
+)
+
+# Transient failures worth retrying; only RateLimitError shrinks the limit
+_RETRYABLE_OPENAI_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+async def _backoff(attempt: int):
+    # Exponential backoff with jitter
+    await asyncio.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1.0))
+
+async def _call_openai(**kwargs):
+    """Create a chat completion under the adaptive limiter, backing off on transient errors."""
+    for attempt in range(OPENAI_MAX_RETRIES):
+        try:
+            async with openai_limiter.slot():
+                return await aclient.chat.completions.create(**kwargs)
+        except _RETRYABLE_OPENAI_ERRORS:
+            if attempt == OPENAI_MAX_RETRIES - 1:
+                raise
+            await _backoff(attempt)
+
+async def _stream_openai(**kwargs) -> AsyncIterator[Any]:
+    """Stream a chat completion, holding a limiter slot until the stream is consumed."""
+    for attempt in range(OPENAI_MAX_RETRIES):
+        started = False
+        try:
+            async with openai_limiter.slot():
+                stream = await aclient.chat.completions.create(stream=True, **kwargs)
+                async for chunk in stream:
+                    started = True
+                    yield chunk
+            return
+        except _RETRYABLE_OPENAI_ERRORS:
+            # Chunks already sent can't be taken back, so only retry before the first
+            if started or attempt == OPENAI_MAX_RETRIES - 1:
+                raise
+            await _backoff(attempt)
+
 # Pydantic models for API payloads
 class ServerConfig(BaseModel):
     name: str
@@ -28,7 +168,9 @@ class ServerConfig(BaseModel):
     args: List[str]
     env: Optional[Dict[str, str]] = None
 
-class ToolInfo(BaseModel):
+# Plain dicts at runtime: tool lists are built on the chat hot path and served
+# as-is by /tools, so they skip Pydantic validation
+class ToolInfo(TypedDict):
     name: str
     description: str
     input_schema: Dict[str, Any]
@@ -44,26 +186,74 @@ class ChatResponse(BaseModel):
     function_call_arguments: Optional[Dict[str, Any]] = None
 
 # MCP Server wrapper
-from mcp import ClientSession, StdioServerParameters
+from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
 
+class NotifyingClientSession(ClientSession):
+    """ClientSession that reports `notifications/tools/list_changed` to a callback."""
+
+    def __init__(self, *args, on_tools_changed: Optional[Callable[[], Awaitable[None]]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._on_tools_changed = on_tools_changed
+
+    async def _received_notification(self, notification: types.ServerNotification) -> None:
+        if self._on_tools_changed and isinstance(notification.root, types.ToolListChangedNotification):
+            await self._on_tools_changed()
+        await super()._received_notification(notification)
+
+def _normalize_schema(schema: Optional[dict]) -> Any:
+    # A missing schema, or an object schema without properties, means no arguments
+    if not schema:
+        return {"type": "object", "properties": {}}
+    if isinstance(schema, dict) and schema.get("type") == "object" and "properties" not in schema:
+        return {**schema, "properties": {}}
+    return schema
+
+def _schema_error(schema: Any) -> Optional[str]:
+    """Return why ``schema`` is unusable as OpenAI function parameters, or None."""
+    if not isinstance(schema, dict):
+        return "input schema is not a JSON object"
+    if schema.get("type") != "object":
+        return f"input schema type is {schema.get('type')!r}, expected 'object'"
+    properties = schema.get("properties")
+    if not isinstance(properties, dict):
+        return "input schema 'properties' is not an object"
+    if not all(isinstance(p, dict) for p in properties.values()):
+        return "input schema has a property that is not a schema object"
+    required = schema.get("required", [])
+    if not isinstance(required, list) or any(r not in properties for r in required):
+        return "input schema 'required' lists unknown properties"
+    return None
+
 class MCPServer:
     def __init__(self, config: ServerConfig):
         self.name = config.name
         self.config = config
         self.session: ClientSession = None  # type: ignore
         self.exit_stack = AsyncExitStack()
-        self._npm_cache_dir = None
+        # Tool list cached for TOOLS_CACHE_TTL seconds or until invalidated
+        self._tools_cache: Optional[List[ToolInfo]] = None
+        self._tools_cache_ts = 0.0
+        # Bumped by invalidate_tools(); the cache is fresh only if it was
+        # fetched at the current generation
+        self._tools_generation = 0
+        self._tools_cache_generation = -1
+        self._inflight_tools: Optional[asyncio.Future] = None
+        # Tools left out of list_tools() because of an invalid input schema, with the reason
+        self.disabled_tools: Dict[str, str] = {}
+        # Called with (server, tools) when a refresh returns a different tool list
+        self.on_tools_changed: Optional[Callable[["MCPServer", List[ToolInfo]], None]] = None
 
     async def start(self):
         command = shutil.which(self.config.command) or self.config.command
-        # Prepare environment, isolating npx cache if needed
+        # Prepare environment, pointing npx at the shared cache if needed
         env = {**os.environ, **(self.config.env or {})}
         if os.path.basename(command) == 'npx':
-            # create a dedicated npm cache for this process
-            self._npm_cache_dir = tempfile.mkdtemp(prefix='mcp_npx_cache_')
-            env['npm_config_cache'] = self._npm_cache_dir
-            env['XDG_CACHE_HOME'] = self._npm_cache_dir
+            # share a persistent npm cache so packages aren't re-downloaded on every start;
+            # created here rather than at import so non-npx setups never touch it
+            os.makedirs(NPX_SHARED_CACHE, exist_ok=True)
+            env['npm_config_cache'] = NPX_SHARED_CACHE
+            env['XDG_CACHE_HOME'] = NPX_SHARED_CACHE
         params = StdioServerParameters(
             command=command,
             args=self.config.args,
@@ -73,67 +263,196 @@ class MCPServer:
         transport = await self.exit_stack.enter_async_context(stdio_client(params))
         read, write = transport
         session = await self.exit_stack.enter_async_context(
-            ClientSession(read, write)
+            NotifyingClientSession(read, write, on_tools_changed=self.invalidate_tools)
         )
         await session.initialize()
         self.session = session
 
     async def list_tools(self) -> List[ToolInfo]:
-        tools_response = await self.session.list_tools()
+        if (
+            self._tools_cache is not None
+            and self._tools_cache_generation == self._tools_generation
+            and time.monotonic() - self._tools_cache_ts < TOOLS_CACHE_TTL
+        ):
+            return self._tools_cache
+        # Single-flight: concurrent callers share one in-flight fetch
+        if self._inflight_tools is None:
+            self._inflight_tools = asyncio.ensure_future(self._fetch_tools())
+        # Shield so a cancelled caller doesn't cancel the fetch for the others
+        return await asyncio.shield(self._inflight_tools)
+
+    async def _fetch_tools(self) -> List[ToolInfo]:
+        # An invalidation during the fetch leaves the result marked stale
+        generation = self._tools_generation
+        try:
+            tools_response = await self.session.list_tools()
+        finally:
+            self._inflight_tools = None
         result: List[ToolInfo] = []
+        disabled: Dict[str, str] = {}
         for item in tools_response:
             if isinstance(item, tuple) and item[0] == "tools":
                 for tool in item[1]:
                     # Coerce None descriptions and input schemas to defaults
                     desc = tool.description or ""
-                    schema = tool.inputSchema or {}
-                    result.append(
-                        ToolInfo(
-                            name=tool.name,
-                            description=desc,
-                            input_schema=schema,
-                        )
-                    )
+                    schema = _normalize_schema(tool.inputSchema)
+                    reason = _schema_error(schema)
+                    if reason:
+                        # Never offer a tool OpenAI would reject
+                        if self.disabled_tools.get(tool.name) != reason:
+                            print(f"Disabling tool '{tool.name}' on server '{self.name}': {reason}")
+                        disabled[tool.name] = reason
+                        continue
+                    result.append({
+                        "name": tool.name,
+                        "description": desc,
+                        "input_schema": schema,
+                    })
+        self.disabled_tools = disabled
+        changed = self._tools_cache is not None and result != self._tools_cache
+        self._tools_cache = result
+        self._tools_cache_ts = time.monotonic()
+        self._tools_cache_generation = generation
+        if changed and self.on_tools_changed:
+            self.on_tools_changed(self, result)
         return result
 
+    def cached_tools(self) -> List[ToolInfo]:
+        return self._tools_cache or []
+
+    async def invalidate_tools(self):
+        # Force the next list_tools() to refetch; the stale list is kept so
+        # the refetch can tell whether anything actually changed
+        self._tools_generation += 1
+
     async def call_tool(self, name: str, arguments: dict):
         return await self.session.call_tool(name, arguments)
 
     async def stop(self):
+        self._tools_cache = None
         await self.exit_stack.aclose()
-        # clean up temporary npm cache directory
-        if self._npm_cache_dir and os.path.exists(self._npm_cache_dir):
-            shutil.rmtree(self._npm_cache_dir, ignore_errors=True)
 
 # Manager for multiple MCP servers
 class ServerManager:
     def __init__(self):
         self.servers: Dict[str, MCPServer] = {}
+        # Maps each tool name to the server exposing it
+        self.tool_registry: Dict[str, MCPServer] = {}
+        # Names of servers currently being started outside the lock
+        self._starting: set = set()
         self._lock = asyncio.Lock()
+        # Bumped whenever the tool set changes; invalidates the cached chat prompt
+        self._tools_version = 0
+        self._prompt_version = -1
+        self._cached_system_msg = ""
+        self._cached_functions_defs: List[dict] = []
+        self._cached_prompt_hash = ""
+
+    async def _start_server(self, config: ServerConfig) -> Tuple[MCPServer, List[ToolInfo]]:
+        server = MCPServer(config)
+        try:
+            await server.start()
+            tools = await server.list_tools()
+        except Exception as e:
+            # Clean up any partial server on failure
+            try:
+                await server.stop()
+            except:
+                pass
+            raise HTTPException(status_code=500, detail=f"Error starting server '{config.name}': {e}")
+        return server, tools
+
+    def _register(self, server: MCPServer, tools: List[ToolInfo]):
+        self.servers[server.name] = server
+        server.on_tools_changed = self._update_tools
+        self._update_tools(server, tools)
+
+    def _update_tools(self, server: MCPServer, tools: List[ToolInfo]):
+        # Release names this server no longer exposes
+        names = {tool["name"] for tool in tools}
+        self._unregister_tools(server, keep=names)
+        for tool in tools:
+            owner = self.tool_registry.get(tool["name"])
+            if owner is None:
+                self.tool_registry[tool["name"]] = server
+            elif owner is not server:
+                # The first server to register a name keeps it
+                print(f"Tool '{tool['name']}' on server '{server.name}' is shadowed by the one on '{owner.name}'")
+        self._tools_version += 1
+
+    def _unregister_tools(self, server: MCPServer, keep: Optional[set] = None):
+        removed = [
+            n for n, owner in self.tool_registry.items()
+            if owner is server and not (keep and n in keep)
+        ]
+        for tool_name in removed:
+            del self.tool_registry[tool_name]
+            # Fall back to another server that also exposes this tool name
+            for other in self.servers.values():
+                if other is not server and any(t["name"] == tool_name for t in other.cached_tools()):
+                    self.tool_registry[tool_name] = other
+                    break
 
     async def add_server(self, config: ServerConfig):
         async with self._lock:
-            if config.name in self.servers:
+            if config.name in self.servers or config.name in self._starting:
                 raise HTTPException(status_code=400, detail="Server already exists")
-            server = MCPServer(config)
-            try:
-                await server.start()
-            except Exception as e:
-                # Clean up any partial server on failure
-                try:
-                    await server.stop()
-                except:
-                    pass
-                raise HTTPException(status_code=500, detail=f"Error starting server '{config.name}': {e}")
-            self.servers[config.name] = server
+            # Reserve the name so concurrent adds of it fail fast
+            self._starting.add(config.name)
+        # Start outside the lock so a slow spawn/handshake doesn't block other admin ops
+        try:
+            server, tools = await self._start_server(config)
+        except BaseException:
+            async with self._lock:
+                self._starting.discard(config.name)
+            raise
+        async with self._lock:
+            self._starting.discard(config.name)
+            self._register(server, tools)
+
+    async def add_servers(self, configs: List[ServerConfig]) -> Dict[str, Optional[str]]:
+        """Start and register ``configs`` concurrently.
+
+        Servers that start are registered even if others fail. Returns each
+        server's error message, or None for those that were added.
+        """
+        names = [c.name for c in configs]
+        async with self._lock:
+            existing = sorted({
+                n for n in names
+                if n in self.servers or n in self._starting or names.count(n) > 1
+            })
+            if existing:
+                raise HTTPException(status_code=400, detail=f"Duplicate server names: {', '.join(existing)}")
+            self._starting.update(names)
+        # Spawn and handshake all servers concurrently, then register them in one go
+        try:
+            results = await asyncio.gather(
+                *(self._start_server(c) for c in configs), return_exceptions=True
+            )
+        except BaseException:
+            async with self._lock:
+                self._starting.difference_update(names)
+            raise
+        async with self._lock:
+            self._starting.difference_update(names)
+            for result in results:
+                if not isinstance(result, BaseException):
+                    self._register(*result)
+        return {
+            name: str(getattr(r, "detail", r)) if isinstance(r, BaseException) else None
+            for name, r in zip(names, results)
+        }
 
     async def remove_server(self, name: str):
         async with self._lock:
             server = self.servers.get(name)
             if not server:
                 raise HTTPException(status_code=404, detail="Server not found")
+            self._unregister_tools(server)
             await server.stop()
             del self.servers[name]
+            self._tools_version += 1
 
     async def list_servers(self) -> List[str]:
         return list(self.servers.keys())
@@ -144,36 +463,32 @@ class ServerManager:
             if not server:
                 raise HTTPException(status_code=404, detail="Server not found")
             return await server.list_tools()
-        # list all
+        # list all, refreshing any stale server caches concurrently
+        results = await asyncio.gather(*(s.list_tools() for s in list(self.servers.values())))
         all_tools: List[ToolInfo] = []
-        for server in self.servers.values():
-            all_tools.extend(await server.list_tools())
+        for tools in results:
+            all_tools.extend(tools)
         return all_tools
 
-    async def call_tool(self, tool_name: str, arguments: dict):
-        # Delegate tool invocation to the server exposing this tool
-        for server in self.servers.values():
-            try:
-                tools = await server.list_tools()
-            except Exception:
-                continue
-            # Find matching tool by name
-            if any(t.name == tool_name for t in tools):
-                return await server.call_tool(tool_name, arguments)
-        # If no server has the tool, raise an error
-        raise HTTPException(status_code=404, detail=f"Tool '{tool_name}' not found on any server")
-
-# Chat session manager
-class ChatManager:
-    def __init__(self, server_manager: ServerManager):
-        self.sm = server_manager
-        self.sessions: Dict[str, dict] = {}
+    async def tool_prompt(self) -> Tuple[str, str, List[dict]]:
+        """Return a prompt hash, chat system message and OpenAI function definitions.
 
-    async def chat(self, req: ChatRequest) -> ChatResponse:
-        sid = req.session_id or str(uuid4())
-        # Fetch current tools and update system message
-        tools = await self.sm.list_tools()
-        tools_desc = "\n".join([f"{t.name}: {t.description}" for t in tools])
+        All three only depend on the set of registered tools, so they are
+        rebuilt lazily after the tool set changes and reused otherwise. The
+        hash is derived from the message and definitions, so it stays
+        comparable across restarts and workers, unlike the local version counter.
+        """
+        # Refreshes any expired server tool caches, bumping the version on change
+        await self.list_tools()
+        if self._prompt_version == self._tools_version:
+            return self._cached_prompt_hash, self._cached_system_msg, self._cached_functions_defs
+        version = self._tools_version
+        # One definition per name, taken from the server that owns it in the registry
+        tools = [
+            t for server in self.servers.values() for t in server.cached_tools()
+            if self.tool_registry.get(t["name"]) is server
+        ]
+        tools_desc = "\n".join([f"{t['name']}: {t['description']}" for t in tools])
         system_msg = (
             "You are a helpful assistant with access to these tools:\n"
             f"{tools_desc}\n\n"
@@ -185,73 +500,237 @@ class ChatManager:
             "}\n"
             "Do not output any descriptive text when invoking a tool. After the tool runs, continue the conversation naturally."
         )
-        if sid not in self.sessions:
-            # Initialize session with system message
-            self.sessions[sid] = {"messages": [{"role": "system", "content": system_msg}]}
-        else:
-            # Refresh system message for new servers/tools
-            self.sessions[sid]["messages"][0]["content"] = system_msg
-        session = self.sessions[sid]
-        session["messages"].append({"role": "user", "content": req.message})
-        # Prepare and call OpenAI with all MCP server tools as functions
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        tools = await self.sm.list_tools()
-        # Build valid JSON schemas for each function; default to empty object if schema missing
-        functions_defs = []
-        for t in tools:
-            raw_schema = t.input_schema or {}
-            if isinstance(raw_schema, dict) and raw_schema.get("type") == "object" and "properties" in raw_schema:
-                params = raw_schema
+        # Input schemas are normalized and validated when tools are discovered
+        functions_defs = [
+            {"name": t["name"], "description": t["description"], "parameters": t["input_schema"]}
+            for t in tools
+        ]
+        prompt_hash = hashlib.sha256(
+            orjson.dumps([system_msg, functions_defs], option=orjson.OPT_SORT_KEYS)
+        ).hexdigest()
+        self._cached_system_msg = system_msg
+        self._cached_functions_defs = functions_defs
+        self._cached_prompt_hash = prompt_hash
+        self._prompt_version = version
+        return prompt_hash, system_msg, functions_defs
+
+    async def call_tool(self, tool_name: str, arguments: dict):
+        # Delegate tool invocation to the server exposing this tool
+        server = self.tool_registry.get(tool_name)
+        if not server:
+            raise HTTPException(status_code=404, detail=f"Tool '{tool_name}' not found on any server")
+        return await server.call_tool(tool_name, arguments)
+
+# Chat session stores
+class SessionStore:
+    """Interface for chat session storage.
+
+    ``get`` returns a private copy of the session, ``save`` persists it and
+    ``lock`` serializes turns on one session.
+    """
+
+    def __init__(self, ttl: int = SESSION_TTL):
+        self.ttl = ttl
+
+    def lock(self, sid: str) -> AsyncContextManager[None]:
+        raise NotImplementedError
+
+    async def get(self, sid: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def save(self, sid: str, session: dict):
+        raise NotImplementedError
+
+class MemorySessionStore(SessionStore):
+    """In-process session store, used when REDIS_URL is not configured.
+
+    Sessions are kept serialized, like in Redis, so a turn that fails before
+    saving leaves no trace in the stored history.
+    """
+
+    def __init__(self, ttl: int = SESSION_TTL):
+        super().__init__(ttl)
+        # Ordered by last save, oldest first, so expiry only inspects the front
+        self._sessions: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        # Per-session lock and the number of turns holding or waiting on it
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def lock(self, sid: str):
+        # Serialize concurrent turns on the same session so their history
+        # updates don't interleave
+        lock, users = self._locks.get(sid) or (asyncio.Lock(), 0)
+        self._locks[sid] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[sid]
+            if users == 1:
+                # Drop the lock once nobody needs it, so locks never outlive use
+                del self._locks[sid]
             else:
-                # Fallback to an empty object schema
-                params = {"type": "object", "properties": {}, "required": []}
-            functions_defs.append({"name": t.name, "description": t.description, "parameters": params})
-        # Attempt chat with function definitions; fallback on schema errors
-        use_functions = True
+                self._locks[sid] = (lock, users - 1)
+
+    async def get(self, sid: str) -> Optional[dict]:
+        entry = self._sessions.get(sid)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            del self._sessions[sid]
+            return None
+        return orjson.loads(entry[1])
+
+    async def save(self, sid: str, session: dict):
+        now = time.monotonic()
+        self._sessions[sid] = (now, orjson.dumps(session))
+        self._sessions.move_to_end(sid)
+        # Evict idle sessions to bound memory
+        while self._sessions:
+            key, (ts, _) = next(iter(self._sessions.items()))
+            if now - ts <= self.ttl:
+                break
+            del self._sessions[key]
+
+class RedisSessionStore(SessionStore):
+    """Session store shared across workers and restarts, backed by Redis."""
+
+    def __init__(self, url: str, ttl: int = SESSION_TTL):
+        super().__init__(ttl)
+        self.redis = aioredis.from_url(url)
+
+    @asynccontextmanager
+    async def lock(self, sid: str):
+        # Serialize turns on the same session across all workers
+        lock = self.redis.lock(f"sess-lock:{sid}", timeout=SESSION_LOCK_TIMEOUT)
+        await lock.acquire()
+        renewer = asyncio.create_task(self._keep_alive(lock, sid))
         try:
-            resp = client.chat.completions.create(
-                model="gpt-4.1",
-                messages=session["messages"],
-                functions=functions_defs,
-                function_call="auto"
-            )
-        except openai.BadRequestError as e:
-            # Invalid function schema; retry without functions
-            print(f"Function schema invalid, skipping functions: {e}")
-            resp = client.chat.completions.create(
-                model="gpt-4.1",
-                messages=session["messages"]
-            )
-            use_functions = False
-        message = resp.choices[0].message
+            yield
+        finally:
+            renewer.cancel()
+            try:
+                await lock.release()
+            except LockError as e:
+                # The turn already finished; losing the lock here mustn't fail it
+                print(f"Session lock for '{sid}' was lost before release: {e}")
+
+    async def _keep_alive(self, lock, sid: str):
+        # Renew the lock while the turn runs, so slow turns don't outlive it
+        while True:
+            await asyncio.sleep(SESSION_LOCK_TIMEOUT / 3)
+            try:
+                await lock.reacquire()
+            except LockError as e:
+                print(f"Could not renew session lock for '{sid}': {e}")
+                return
+
+    async def get(self, sid: str) -> Optional[dict]:
+        raw = await self.redis.get(f"sess:{sid}")
+        if raw is None:
+            return None
+        return orjson.loads(raw)
+
+    async def save(self, sid: str, session: dict):
+        await self.redis.set(f"sess:{sid}", orjson.dumps(session), ex=self.ttl)
+
+# Chat session manager
+class ChatManager:
+    def __init__(self, server_manager: ServerManager, store: SessionStore):
+        self.sm = server_manager
+        self.store = store
+
+    async def chat(self, req: ChatRequest) -> ChatResponse:
+        sid = req.session_id or str(uuid4())
+        async with self.store.lock(sid):
+            return await self._chat(sid, req)
+
+    async def chat_stream(self, req: ChatRequest) -> AsyncIterator[str]:
+        """Run a chat turn, yielding the reply as server-sent events."""
+        sid = req.session_id or str(uuid4())
+        async with self.store.lock(sid):
+            session, message = await self._start_turn(sid, req)
+            yield _sse({"session_id": sid})
+            # The response has started, so failures from here on are reported
+            # as an error event, and the session is left untouched
+            try:
+                content = ""
+                if getattr(message, "function_call", None):
+                    func_name = message.function_call.name
+                    args = orjson.loads(message.function_call.arguments)
+                    yield _sse({"function_call_name": func_name, "function_call_arguments": args})
+                    try:
+                        await self._invoke_tool(session, func_name, args)
+                        # Stream the final assistant reply as it is generated
+                        stream = _stream_openai(
+                            model=FOLLOWUP_MODEL,
+                            messages=session["messages"],
+                            max_tokens=MAX_COMPLETION_TOKENS
+                        )
+                        try:
+                            async for chunk in stream:
+                                delta = chunk.choices[0].delta.content if chunk.choices else None
+                                if delta:
+                                    content += delta
+                                    yield _sse({"delta": delta})
+                        finally:
+                            # Release the limiter slot promptly if the client disconnects
+                            await stream.aclose()
+                    except openai.APIError:
+                        raise
+                    except Exception as e:
+                        import traceback; traceback.print_exc()
+                        content = f"Error calling tool {func_name}: {e}"
+                        yield _sse({"error": content})
+                else:
+                    content = message.content or ""
+                    yield _sse({"delta": content})
+                session["messages"].append({"role": "assistant", "content": content})
+                await self._trim_history(session)
+                await self.store.save(sid, session)
+            except openai.APIError as e:
+                import traceback; traceback.print_exc()
+                error = _openai_http_error(e)
+                yield _sse({"error": error.detail, "status": error.status_code})
+                return
+            except Exception as e:
+                import traceback; traceback.print_exc()
+                yield _sse({"error": str(e), "status": 500})
+                return
+            yield _sse({"done": True})
+
+    async def _chat(self, sid: str, req: ChatRequest) -> ChatResponse:
+        session, message = await self._start_turn(sid, req)
         func_call_name = None
         func_call_args = None
-        # Handle tool invocation only if functions were used and a tool was called
-        if use_functions and getattr(message, "function_call", None):
+        # Handle tool invocation only if a tool was called
+        if getattr(message, "function_call", None):
             func_name = message.function_call.name
-            args = json.loads(message.function_call.arguments)
+            args = orjson.loads(message.function_call.arguments)
             # capture for response
             func_call_name = func_name
             func_call_args = args
             try:
-                result = await self.sm.call_tool(func_name, args)
-                # Ensure result is JSON serializable
-                encoded = jsonable_encoder(result)
-                session["messages"].append({
-                    "role": "function", "name": func_name, "content": json.dumps(encoded)
-                })
+                await self._invoke_tool(session, func_name, args)
                 # Get final assistant reply
-                resp2 = client.chat.completions.create(
-                    model="gpt-4.1", messages=session["messages"]
+                resp2 = await _call_openai(
+                    model=FOLLOWUP_MODEL,
+                    messages=session["messages"],
+                    max_tokens=MAX_COMPLETION_TOKENS
                 )
                 final_msg = resp2.choices[0].message
                 content = final_msg.content or ""
+            except openai.APIError:
+                # Provider failures surface as 429/502/503, not as a tool error
+                raise
             except Exception as e:
                 import traceback; traceback.print_exc()
                 content = f"Error calling tool {func_name}: {e}"
         else:
             content = message.content or ""
         session["messages"].append({"role": "assistant", "content": content})
+        await self._trim_history(session)
+        await self.store.save(sid, session)
         # Return content and any function call info
         return ChatResponse(
             session_id=sid,
@@ -260,8 +739,102 @@ class ChatManager:
             function_call_arguments=func_call_args
         )
 
+    async def _start_turn(self, sid: str, req: ChatRequest):
+        """Load the session, append the user message and run the first completion."""
+        # System message and function definitions for the current tool set
+        prompt_hash, system_msg, functions_defs = await self.sm.tool_prompt()
+        session = await self.store.get(sid)
+        if session is None:
+            # Initialize session with system message
+            session = {
+                "messages": [{"role": "system", "content": system_msg}],
+                "prompt_hash": prompt_hash,
+            }
+        elif session.get("prompt_hash") != prompt_hash:
+            # Refresh system message only when servers/tools changed, keeping
+            # the prompt prefix stable for provider-side caching otherwise
+            session["messages"][0]["content"] = system_msg
+            session["prompt_hash"] = prompt_hash
+        session["messages"].append({"role": "user", "content": req.message})
+        # Schemas were validated at discovery, so no fallback is needed here;
+        # OpenAI rejects an empty function list, so omit it when there are no tools
+        kwargs = {"functions": functions_defs, "function_call": "auto"} if functions_defs else {}
+        resp = await _call_openai(
+            model=PRIMARY_MODEL,
+            messages=session["messages"],
+            max_tokens=PRIMARY_MAX_TOKENS,
+            **kwargs
+        )
+        choice = resp.choices[0]
+        if choice.finish_reason == "length" and getattr(choice.message, "function_call", None):
+            # Truncated arguments aren't valid JSON; fail the turn instead of guessing
+            raise HTTPException(
+                status_code=502,
+                detail=f"Tool call '{choice.message.function_call.name}' was cut off at "
+                       f"PRIMARY_MAX_TOKENS={PRIMARY_MAX_TOKENS}; raise the limit to allow it",
+            )
+        return session, choice.message
+
+    async def _invoke_tool(self, session: dict, func_name: str, args: dict):
+        result = await self.sm.call_tool(func_name, args)
+        # Ensure result is JSON serializable
+        encoded = jsonable_encoder(result)
+        session["messages"].append({
+            "role": "function", "name": func_name, "content": orjson.dumps(encoded).decode("utf-8")
+        })
+
+    async def _trim_history(self, session: dict):
+        """Bound the history resent on every turn to keep input tokens constant."""
+        messages = session["messages"]
+        # Large tool results have served their turn; keep only their head
+        for m in messages:
+            content = m.get("content") or ""
+            if m["role"] == "function" and len(content) > MAX_TOOL_RESULT_CHARS:
+                m["content"] = content[:MAX_TOOL_RESULT_CHARS] + "... [truncated]"
+        size = sum(len(m.get("content") or "") for m in messages)
+        if len(messages) <= MAX_HISTORY_MESSAGES and size <= MAX_HISTORY_CHARS:
+            return
+        system, history = messages[0], messages[1:]
+        # The latest turn, starting at its user message, is always kept
+        last_user = max(
+            (i for i, m in enumerate(history) if m["role"] == "user"), default=len(history) - 1
+        )
+        start = min(max(0, len(history) - HISTORY_KEEP_MESSAGES), last_user)
+        size = sum(len(m.get("content") or "") for m in [system] + history[start:])
+        # Drop from the front until the window fits under the character cap
+        while start < last_user and size > MAX_HISTORY_CHARS:
+            size -= len(history[start].get("content") or "")
+            start += 1
+        # Open the window on a user message so no reply is cut off from its request
+        while start < last_user and history[start]["role"] != "user":
+            start += 1
+        if start == 0:
+            return
+        dropped, kept = history[:start], history[start:]
+        trimmed = [system]
+        if SUMMARIZE_HISTORY:
+            transcript = "\n".join(f"{m['role']}: {m.get('content') or ''}" for m in dropped)
+            try:
+                resp = await _call_openai(
+                    model=FOLLOWUP_MODEL,
+                    messages=[
+                        {"role": "system", "content": "Summarize this conversation in a few sentences, keeping facts the assistant may need later."},
+                        {"role": "user", "content": transcript},
+                    ],
+                    max_tokens=MAX_COMPLETION_TOKENS,
+                )
+                summary = resp.choices[0].message.content
+                if summary:
+                    trimmed.append({"role": "system", "content": f"Summary of earlier conversation: {summary}"})
+            except Exception:
+                import traceback; traceback.print_exc()
+        session["messages"] = trimmed + kept
+
+def _sse(data: dict) -> str:
+    return f"data: {orjson.dumps(data).decode('utf-8')}\n\n"
+
 # Initialize FastAPI app
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Enable CORS for frontend
 app.add_middleware(
@@ -272,7 +845,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 sm = ServerManager()
-cm = ChatManager(sm)
+store = RedisSessionStore(REDIS_URL) if REDIS_URL else MemorySessionStore()
+cm = ChatManager(sm, store)
 
 @app.post("/servers")
 async def api_add_server(conf: ServerConfig):
@@ -284,6 +858,27 @@ async def api_add_server(conf: ServerConfig):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error adding server: {e}")
 
+@app.post("/servers/batch")
+async def api_add_servers(confs: List[ServerConfig]):
+    try:
+        errors = await sm.add_servers(confs)
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error adding servers: {e}")
+    results = {
+        name: {"status": "ok"} if error is None else {"status": "error", "detail": error}
+        for name, error in errors.items()
+    }
+    added = sum(error is None for error in errors.values())
+    # Report per-server outcomes; fail the request only if nothing was added
+    return ORJSONResponse(
+        {"status": "ok" if added == len(errors) else "partial" if added else "error", "results": results},
+        status_code=200 if added or not errors else 500,
+    )
+
 @app.get("/servers")
 async def api_list_servers():
     return await sm.list_servers()
@@ -295,13 +890,51 @@ async def api_delete_server(name: str):
 
 @app.get("/tools")
 async def api_list_tools(server: Optional[str] = None):
-    return await sm.list_tools(server)
+    # Return the cached dicts directly, bypassing jsonable_encoder
+    return ORJSONResponse(await sm.list_tools(server))
+
+def _openai_http_error(e: openai.APIError) -> HTTPException:
+    # Surface provider trouble to the client instead of degrading silently.
+    # Only transient failures get 503; rejected requests (bad model, context
+    # overflow, auth) won't succeed on retry, so they map to 502.
+    if isinstance(e, openai.RateLimitError):
+        return HTTPException(status_code=429, detail=f"LLM provider rate limit: {e}")
+    if isinstance(e, openai.APIConnectionError) or (
+        isinstance(e, openai.APIStatusError) and e.status_code >= 500
+    ):
+        return HTTPException(status_code=503, detail=f"LLM provider unavailable: {e}")
+    return HTTPException(status_code=502, detail=f"LLM provider rejected the request: {e}")
 
 @app.post("/chat", response_model=ChatResponse)
 async def api_chat(req: ChatRequest):
     try:
         return await cm.chat(req)
+    except HTTPException:
+        raise
+    except openai.APIError as e:
+        import traceback
+        traceback.print_exc()
+        raise _openai_http_error(e)
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/chat/stream")
+async def api_chat_stream(req: ChatRequest):
+    events = cm.chat_stream(req)
+    # Run the first completion before the response starts, so its errors
+    # can still be reported with a status code
+    try:
+        first = await events.__anext__()
+    except openai.APIError as e:
+        import traceback
+        traceback.print_exc()
+        raise _openai_http_error(e)
+
+    async def relay():
+        yield first
+        async for event in events:
+            yield event
+
+    return StreamingResponse(relay(), media_type="text/event-stream")